@@ -1,22 +1,31 @@
 import argparse
-import json
+import mmap
 import os
 import sys
+import threading
+import traceback
+from contextlib import contextmanager
 from functools import partial
 from multiprocessing import Pool, cpu_count, Value
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
+import orjson
 from google.appengine.api import datastore
 from google.appengine.api.datastore_types import EmbeddedEntity
 from google.appengine.datastore import entity_bytes_pb2 as entity_pb2
 
 from converter import records
-from converter.exceptions import BaseError, ValidationError
-from converter.utils import embedded_entity_to_dict, get_dest_dict, serialize_json
+from converter.exceptions import BaseError, ProcessingError, ValidationError
+from converter.utils import (
+    embedded_entity_to_dict,
+    float_to_json,
+    get_dest_dict,
+    serialize_json,
+)
 
-num_files: Value = Value("i", 0)
-num_files_processed: Value = Value("i", 0)
+# Bound in each pool worker by _init_worker.
+num_files_processed: Optional[Value] = None
 
 
 def main(args=None):
@@ -70,6 +79,11 @@ def main(args=None):
     )
 
     args = parser.parse_args(args)
+    if not args.no_check_crc and not records.HAS_ACCELERATED_CRC:
+        print(
+            "Warning: accelerated crc32c is unavailable, CRC checks will be slow. "
+            "Use -c/--no-check-crc to skip them."
+        )
     try:
         source_dir = os.path.abspath(args.source_dir)
         if not os.path.isdir(source_dir):
@@ -81,14 +95,21 @@ def main(args=None):
 
         Path(dest_dir).mkdir(parents=True, exist_ok=True)
 
-        if os.listdir(dest_dir) and args.clean_dest:
-            print("Destination directory is not empty. Deleting json files...")
-            for f in Path(dest_dir).glob("*.json"):
-                try:
-                    print(f"Deleting file {f.name}")
-                    f.unlink()
-                except OSError as e:
-                    print("Error: %s : %s" % (f, e.strerror))
+        if args.clean_dest:
+            print("Deleting json files from destination directory...")
+            num_deleted = 0
+            with os.scandir(dest_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json") or entry.is_dir(
+                        follow_symlinks=False
+                    ):
+                        continue
+                    try:
+                        os.unlink(entry.path)
+                        num_deleted += 1
+                    except OSError as e:
+                        print("Error: %s : %s" % (entry.path, e.strerror))
+            print(f"Deleted {num_deleted} json file(s)")
 
         process_files(
             source_dir=source_dir,
@@ -101,54 +122,144 @@ def main(args=None):
         sys.exit(1)
 
 
+def _init_worker(counter: Value):
+    global num_files_processed
+    num_files_processed = counter
+
+
 def process_files(
     source_dir: str, dest_dir: str, num_processes: int, no_check_crc: bool
 ):
-    p = Pool(num_processes)
-    files = sorted(os.listdir(source_dir))
-    num_files.value = len(files)
-    print(f"processing {num_files.value} file(s)")
-
-    f = partial(process_file, source_dir, dest_dir, no_check_crc)
-    p.map(f, files)
-    print(
-        f"processed: {num_files_processed.value}/{num_files.value} {num_files_processed.value/num_files.value*100}%"
+    files = [f for f in os.listdir(source_dir) if f.startswith("output-")]
+    # Largest files first so a big file at the end doesn't leave workers idle.
+    files.sort(
+        key=lambda f: os.path.getsize(os.path.join(source_dir, f)), reverse=True
+    )
+    total = len(files)
+    print(f"processing {total} file(s)")
+
+    if total == 0:
+        return
+
+    counter = Value("i", 0, lock=True)
+    stop_reporting = threading.Event()
+    reporter = threading.Thread(
+        target=_report_progress, args=(counter, total, stop_reporting), daemon=True
     )
+    reporter.start()
+    f = partial(_try_process_file, source_dir, dest_dir, no_check_crc)
+    errors = []
+    try:
+        with Pool(num_processes, initializer=_init_worker, initargs=(counter,)) as p:
+            # Drain every result so one bad shard doesn't terminate the others.
+            for error in p.imap_unordered(f, files, chunksize=1):
+                if error is not None:
+                    errors.append(error)
+    finally:
+        stop_reporting.set()
+        reporter.join()
+    print(f"processed: {counter.value}/{total} {counter.value/total*100}%")
+    if errors:
+        raise ProcessingError(
+            f"Failed to process {len(errors)} file(s):\n" + "\n".join(errors)
+        )
+
+
+def _report_progress(counter: Value, total: int, stop: threading.Event):
+    """Report progress from the shared counter until stopped.
+
+    On a terminal a single line is redrawn in place; otherwise (logs, pipes)
+    each update is written on its own line.
+    """
+    redraw = sys.stdout.isatty()
+    last = -1
+    while True:
+        stopped = stop.wait(0.5)
+        done = counter.value
+        if done != last:
+            line = f"progress: {done}/{total} {done/total*100}%"
+            sys.stdout.write(f"\r{line}" if redraw else f"{line}\n")
+            sys.stdout.flush()
+            last = done
+        if stopped:
+            break
+    if redraw:
+        sys.stdout.write("\n")
+
+
+@contextmanager
+def _map_export_file(path: str):
+    """Memory-map an export file read-only for sequential record reads."""
+    with open(path, "rb") as raw:
+        # mmap refuses zero-length files; the plain file object reads as EOF.
+        if os.fstat(raw.fileno()).st_size == 0:
+            yield raw
+            return
+        with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield mm
+
+
+def _try_process_file(
+    source_dir: str, dest_dir: str, no_check_crc: bool, filename: str
+) -> Optional[str]:
+    """Run process_file, returning a description of any failure instead of raising."""
+    try:
+        process_file(source_dir, dest_dir, no_check_crc, filename)
+    except Exception:
+        return f"{filename}: {traceback.format_exc()}"
+    return None
 
 
 def process_file(source_dir: str, dest_dir: str, no_check_crc: bool, filename: str):
-    if not filename.startswith("output-"):
-        return
     json_tree: Dict = {}
     in_file = os.path.join(source_dir, filename)
+    out_file_path = f"{dest_dir}{os.sep}{filename}.json"
+
+    # Hot loop locals: one reusable proto (ParseFromString clears it first) and
+    # fast lookups instead of module globals/attributes per record.
+    entity_proto = entity_pb2.EntityProto()
+    parse_entity = entity_proto.ParseFromString
+    entity_from_pb = datastore.Entity.FromPb
+    embedded_entity = EmbeddedEntity
+    to_dict = embedded_entity_to_dict
 
-    with open(in_file, "rb") as raw:
+    with _map_export_file(in_file) as raw:
         reader = records.RecordsReader(raw, no_check_crc=no_check_crc)
         for record in reader:
-            entity_proto = entity_pb2.EntityProto()
-            entity_proto.ParseFromString(record)
-            ds_entity = datastore.Entity.FromPb(entity_proto)
-            data = {}
-            for name, value in list(ds_entity.items()):
-                if isinstance(value, EmbeddedEntity):
-                    dt: Dict = {}
-                    data[name] = embedded_entity_to_dict(value, dt)
-                else:
-                    data[name] = value
-
+            parse_entity(record)
+            ds_entity = entity_from_pb(entity_proto)
             data_dict = get_dest_dict(ds_entity.key(), json_tree)
-            data_dict.update(data)
+            for name, value in ds_entity.items():
+                if isinstance(value, embedded_entity):
+                    data_dict[name] = to_dict(value, {})
+                elif isinstance(value, float):
+                    # orjson would write non-finite floats as null.
+                    data_dict[name] = float_to_json(value)
+                elif isinstance(value, list):
+                    data_dict[name] = [
+                        float_to_json(v) if isinstance(v, float) else v
+                        for v in value
+                    ]
+                else:
+                    data_dict[name] = value
 
-    out_file_path = os.path.join(dest_dir, filename + ".json")
-    with open(out_file_path, "w", encoding="utf8") as out:
-        out.write(
-            json.dumps(json_tree, default=serialize_json, ensure_ascii=False, indent=2)
-        )
-    num_files_processed.value += 1
-    if num_files.value > 0:
-        print(
-            f"progress: {num_files_processed.value}/{num_files.value} {num_files_processed.value/num_files.value*100}%"
-        )
+    # Serialize before opening so a failure doesn't leave an empty output file.
+    output = orjson.dumps(
+        json_tree,
+        default=serialize_json,
+        # Keep datetimes going through serialize_json (epoch millis) rather
+        # than orjson's native RFC 3339 output; ids may be int keys.
+        option=orjson.OPT_INDENT_2
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME,
+    )
+    with open(out_file_path, "wb") as out:
+        out.write(output)
+    if num_files_processed is not None:
+        with num_files_processed.get_lock():
+            num_files_processed.value += 1
 
 
 if __name__ == "__main__":
@@ -8,3 +8,9 @@ class ValidationError(BaseError):
     """Raised when validation error occurs."""
 
     pass
+
+
+class ProcessingError(BaseError):
+    """Raised when one or more export files fail to convert."""
+
+    pass
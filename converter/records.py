@@ -28,6 +28,21 @@ RECORD_TYPE_MIDDLE = 3
 
 RECORD_TYPE_LAST = 4
 
+# google_crc32c falls back to a pure python implementation when its C extension
+# is unavailable; that is orders of magnitude slower than the hardware path.
+HAS_ACCELERATED_CRC = google_crc32c.implementation == "c"
+
+crc32c = google_crc32c.value
+
+crc32c_extend = google_crc32c.extend
+
+# The checksum covers the record type byte followed by the payload. Seeding from
+# the precomputed CRC of the type byte avoids copying the payload to prepend it.
+_RECORD_TYPE_CRCS = [
+    crc32c(record_type.to_bytes(RECORD_TYPE_LENGTH, ENDIANNESS))
+    for record_type in range(256)
+]
+
 
 class Error(Exception):
     """Base class for exceptions in this module."""
@@ -120,9 +135,7 @@ class RecordsReader(object):
             return ("", record_type)
 
         if not self.no_check_crc:
-            actual_crc = google_crc32c.value(
-                record_type.to_bytes(RECORD_TYPE_LENGTH, ENDIANNESS) + data
-            )
+            actual_crc = crc32c_extend(_RECORD_TYPE_CRCS[record_type], data)
             if actual_crc != _unmask_crc(masked_crc):
                 raise InvalidRecordError("Data crc does not match")
         return (data, record_type)
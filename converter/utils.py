@@ -1,10 +1,10 @@
-from base64 import b64decode
 import calendar
 import datetime
-from typing import Dict
+import math
 
 from google.appengine.datastore import entity_bytes_pb2 as entity_pb2
-from google.protobuf.json_format import MessageToDict
+
+ENTITY_PROTO = entity_pb2.Property.ENTITY_PROTO
 
 
 def get_dest_dict(key, json_tree):
@@ -28,43 +28,56 @@ def get_dest_dict(key, json_tree):
         return json_tree2[kind][id_or_name]
 
 
-def get_value(value: Dict, raw=False):
-    v = value.get("stringValue")
-    if v:
-        decoded_value = b64decode(v)
-        return decoded_value if raw else decoded_value.decode("utf-8", errors="ignore")
+def float_to_json(value: float):
+    # JSON has no NaN/Infinity literals; spell them as MessageToDict does.
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return value
+
 
-    v = value.get("int64Value")
+def get_value(value: entity_pb2.PropertyValue, raw=False):
+    # Mirrors the values json_format.MessageToDict used to produce here: empty
+    # strings are treated as unset and non-finite doubles become strings.
+    v = value.stringValue
     if v:
-        # not certain why, but without the cast to `int` here it shows up as a str in the output
-        return int(v)
+        return v if raw else v.decode("utf-8", errors="ignore")
 
-    return value.get("doubleValue", value.get("booleanValue"))
+    if value.HasField("int64Value"):
+        return value.int64Value
+
+    if value.HasField("doubleValue"):
+        return float_to_json(value.doubleValue)
+
+    if value.HasField("booleanValue"):
+        return value.booleanValue
+    return None
 
 
 def embedded_entity_to_dict(embedded_entity, data):
-    ep = entity_pb2.EntityProto()
-    ep.ParseFromString(embedded_entity)
-    d = MessageToDict(ep)
-    for entry in d.get("rawProperty", []):
-        name = entry.get("name")
-        value = entry.get("value")
-        multiple = entry.get("multiple")
-        if multiple and not name in data:
-            data[name] = []
-        if entry.get("meaning") == "ENTITY_PROTO":
-            dt = {}
-            newdata = embedded_entity_to_dict(get_value(value, raw=True), dt)
-            if multiple:
-                data[name].append(newdata)
+    # Walk nested entities with an explicit stack rather than recursion. Nested
+    # dicts are attached to their parent before being filled in, so key order
+    # matches the recursive version.
+    stack = [(embedded_entity, data)]
+    while stack:
+        serialized, dest = stack.pop()
+        ep = entity_pb2.EntityProto()
+        ep.ParseFromString(serialized)
+        for prop in ep.raw_property:
+            name = prop.name
+            multiple = prop.multiple
+            if multiple and not name in dest:
+                dest[name] = []
+            if prop.meaning == ENTITY_PROTO:
+                newdata = {}
+                stack.append((get_value(prop.value, raw=True), newdata))
             else:
-                data[name] = newdata
-        else:
-            newdata = get_value(value)
+                newdata = get_value(prop.value)
             if multiple:
-                data[name].append(newdata)
+                dest[name].append(newdata)
             else:
-                data[name] = newdata
+                dest[name] = newdata
     return data
 
 
@@ -27,7 +27,7 @@ setup(
     packages=packages,
     long_description_content_type='text/markdown',
     long_description=open('README.md').read(),
-    python_requires='>=3.7, <4',
+    python_requires='>=3.8, <4',
     install_requires=requirements,
     include_package_data=True,
     entry_points={
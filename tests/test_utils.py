@@ -0,0 +1,122 @@
+import math
+from base64 import b64decode
+
+import orjson
+from google.appengine.api import datastore
+from google.appengine.api.datastore_types import Blob, EmbeddedEntity
+from google.appengine.datastore import entity_bytes_pb2 as entity_pb2
+from google.protobuf.json_format import MessageToDict
+
+from converter.utils import embedded_entity_to_dict, float_to_json
+
+
+def _embedded(props):
+    entity = datastore.Entity("Inner", _app="test", unindexed_properties=list(props))
+    entity.update(props)
+    return EmbeddedEntity(entity.ToPb().SerializeToString())
+
+
+# The MessageToDict based conversion embedded_entity_to_dict replaced, kept as
+# the reference its output must match.
+def _reference_get_value(value, raw=False):
+    v = value.get("stringValue")
+    if v:
+        decoded_value = b64decode(v)
+        return decoded_value if raw else decoded_value.decode("utf-8", errors="ignore")
+
+    v = value.get("int64Value")
+    if v:
+        return int(v)
+
+    return value.get("doubleValue", value.get("booleanValue"))
+
+
+def _reference_embedded_entity_to_dict(embedded_entity, data):
+    ep = entity_pb2.EntityProto()
+    ep.ParseFromString(embedded_entity)
+    d = MessageToDict(ep)
+    for entry in d.get("rawProperty", []):
+        name = entry.get("name")
+        value = entry.get("value")
+        multiple = entry.get("multiple")
+        if multiple and not name in data:
+            data[name] = []
+        if entry.get("meaning") == "ENTITY_PROTO":
+            newdata = _reference_embedded_entity_to_dict(
+                _reference_get_value(value, raw=True), {}
+            )
+        else:
+            newdata = _reference_get_value(value)
+        if multiple:
+            data[name].append(newdata)
+        else:
+            data[name] = newdata
+    return data
+
+
+EDGE_VALUES = {
+    "empty_string": "",
+    "zero": 0,
+    "zero_float": 0.0,
+    "false": False,
+    "true": True,
+    "none": None,
+    "nan": float("nan"),
+    "inf": float("inf"),
+    "ninf": float("-inf"),
+    "big": 2**62,
+    "negative": -5,
+    "float": 1.5,
+    "unicode": "ünï",
+    "blob": Blob(b"\xff\xfeab"),
+    "mixed": [1, "a", 2.5, None],
+}
+
+
+def _nested_entity():
+    return _embedded(
+        {
+            "x": 1,
+            "deep": _embedded({"y": "z", "nums": [1, 2]}),
+            "many": [_embedded({"k": 1}), _embedded({"k": 2, "inner": _embedded({})})],
+            "edge": _embedded(EDGE_VALUES),
+        }
+    )
+
+
+def test_embedded_entity_to_dict_matches_message_to_dict():
+    entity = _nested_entity()
+    expected = _reference_embedded_entity_to_dict(entity, {})
+    actual = embedded_entity_to_dict(entity, {})
+    assert orjson.dumps(actual) == orjson.dumps(expected)
+
+
+def test_embedded_entity_to_dict_values():
+    data = embedded_entity_to_dict(_nested_entity(), {})
+    assert data["x"] == 1
+    assert data["deep"] == {"nums": [1, 2], "y": "z"}
+    assert data["many"] == [{"k": 1}, {"inner": {}, "k": 2}]
+    assert data["edge"] == {
+        "big": 2**62,
+        "blob": "ab",
+        "empty_string": None,
+        "false": False,
+        "float": 1.5,
+        "inf": "Infinity",
+        "mixed": [1, "a", 2.5, None],
+        "nan": "NaN",
+        "negative": -5,
+        "ninf": "-Infinity",
+        "none": None,
+        "true": True,
+        "unicode": "ünï",
+        "zero": 0,
+        "zero_float": 0.0,
+    }
+
+
+def test_float_to_json():
+    assert float_to_json(1.5) == 1.5
+    assert float_to_json(math.nan) == "NaN"
+    assert float_to_json(math.inf) == "Infinity"
+    assert float_to_json(-math.inf) == "-Infinity"